@@ -1,15 +1,23 @@
+import hashlib
 import os
 import tempfile
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 from taxotagger import ProjectConfig, TaxoTagger
 from taxotagger.defaults import PRETRAINED_MODELS, TAXONOMY_LEVELS
-from taxotagger.utils import parse_fasta, parse_unite_fasta_header
+from taxotagger.utils import parse_unite_fasta_header
 
 # Global variables
 LOGO_IMAGE = "images/TaxoTagger-logo.svg"
+# Taxonomy levels paired with their capitalized column names
+TAX_PAIRS = tuple((level, level.capitalize()) for level in TAXONOMY_LEVELS)
+# Write temporary FASTA files to memory-backed storage when available
+TEMP_DIR = (
+    "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+)
 
 # Config page
 st.set_page_config(
@@ -39,57 +47,87 @@ tt = initialize_taxotagger()
 
 
 # Input method selection
-def validate_input(fasta_content):
-    """Validate the FASTA input."""
-    try:
-        header_seq_dict = parse_fasta(fasta_content)
-    except ValueError as e:
-        st.error(
-            e.args[0] + "\n\nPlease ensure all FASTA headers are unique.", icon="⚠️"
-        )
-        st.stop()
+@st.cache_data(max_entries=32, show_spinner=False)
+def _parse_and_validate(fasta_digest, _fasta_content):
+    """Parse the FASTA content and check its headers and sequences.
+
+    The content is cached by its digest; the underscore keeps Streamlit from
+    hashing the full text on every call.
 
+    Returns a tuple of the number of sequences and the list of sequence IDs.
+    Raises ValueError with a user-facing message if the input is invalid.
+    """
+    seen_headers = set()
     seq_ids = []
+    seen_ids = set()
     seq_header_dict = {}
-    for header, seq in header_seq_dict.items():
+    # The search step parses the file with Biopython's "fasta" format, which
+    # rejects anything (including blank lines or a BOM) before the first header
+    if _fasta_content and not _fasta_content.startswith(">"):
+        raise ValueError(
+            "Invalid FASTA input. Please ensure the input starts with a '>' header line, with no text, spaces or blank lines before it."
+        )
+
+    # Split the records in one pass
+    for record in ("\n" + _fasta_content).split("\n>")[1:]:
+        header, _, seq = record.partition("\n")
+        header = header.rstrip()
+        seq = "".join(seq.split())
+
         # empty header
         if not header:
-            st.error(
-                "Invalid FASTA header(s) found. Please ensure that each header starts with '>' plus at least one more non-empty character.",
-                icon="⚠️",
+            raise ValueError(
+                "Invalid FASTA header(s) found. Please ensure that each header starts with '>' plus at least one more non-empty character."
+            )
+
+        # duplicate header
+        if header in seen_headers:
+            raise ValueError(
+                f"Duplicate FASTA header found: `{header}`\n\nPlease ensure all FASTA headers are unique."
             )
-            st.stop()
+        seen_headers.add(header)
 
         # duplicate ID
         seq_id = parse_unite_fasta_header(header)[0]
-        if seq_id not in seq_ids:
-            seq_ids.append(seq_id)
-        else:
-            st.error(
-                f"Duplicate sequence ID found: `{seq_id}`\n\nPlease ensure all sequence IDs are unique.",
-                icon="⚠️",
+        if seq_id in seen_ids:
+            raise ValueError(
+                f"Duplicate sequence ID found: `{seq_id}`\n\nPlease ensure all sequence IDs are unique."
             )
-            st.stop()
+        seen_ids.add(seq_id)
+        seq_ids.append(seq_id)
 
         # empty sequence
         if not seq:
-            st.error(
-                f"Empty sequence found for: `{header}`. Please ensure all sequences are non-empty.",
-                icon="⚠️",
+            raise ValueError(
+                f"Empty sequence found for: `{header}`. Please ensure all sequences are non-empty."
             )
-            st.stop()
 
         # duplicate sequence
         if seq in seq_header_dict:
-            st.error(
-                f"`{header}` and `{seq_header_dict[seq]}` have the same DNA sequence. Please ensure all sequences are unique.",
-                icon="⚠️",
+            raise ValueError(
+                f"`{header}` and `{seq_header_dict[seq]}` have the same DNA sequence. Please ensure all sequences are unique."
             )
-            st.stop()
         else:
             seq_header_dict[seq] = header
 
-    num_seqs = len(header_seq_dict)
+    return len(seq_ids), seq_ids
+
+
+def validate_input(fasta_content):
+    """Validate the FASTA input."""
+    # Only hash the content when it differs from the last validated input
+    if st.session_state.get("fasta_content") == fasta_content:
+        fasta_digest = st.session_state["fasta_digest"]
+    else:
+        fasta_digest = hashlib.blake2b(
+            fasta_content.encode(), digest_size=16
+        ).hexdigest()
+    try:
+        num_seqs, seq_ids = _parse_and_validate(fasta_digest, fasta_content)
+    except ValueError as e:
+        st.error(e.args[0], icon="⚠️")
+        st.stop()
+
     if num_seqs > 100:
         st.error("Please limit the number of sequences to 100 or fewer.", icon="⚠️")
         st.stop()
@@ -101,6 +139,16 @@ def validate_input(fasta_content):
 
     st.session_state["seq_ids"] = seq_ids
     st.session_state["fasta_content"] = fasta_content
+    st.session_state["fasta_digest"] = fasta_digest
+
+
+def _clear_inputs():
+    """Remove the validated input from the session state.
+
+    Previous results are kept, but are only shown again for the same input.
+    """
+    for key in ("fasta_content", "fasta_digest", "seq_ids"):
+        st.session_state.pop(key, None)
 
 
 st.subheader("Enter DNA Sequence")
@@ -109,7 +157,7 @@ input_method = st.radio(
     ["Upload FASTA file(s)", "Enter FASTA text"],
     horizontal=True,
     label_visibility="collapsed",
-    on_change=st.session_state.clear,
+    on_change=_clear_inputs,
 )
 
 if input_method == "Enter FASTA text":
@@ -121,7 +169,7 @@ if input_method == "Enter FASTA text":
     if fasta_content:
         validate_input(fasta_content)
     else:
-        st.session_state.clear()
+        _clear_inputs()
 
 else:
     uploaded_files = st.file_uploader(
@@ -130,152 +178,201 @@ else:
         accept_multiple_files=True,
     )
     if uploaded_files:
-        fasta_content = ""
-        for uploaded_file in uploaded_files:
-            # "/n" is needed to ensure the last sequence is not concatenated with the next one
-            file_content = uploaded_file.getvalue().decode() + "\n"
-            fasta_content += file_content
+        # "/n" is needed to ensure the last sequence is not concatenated with the next one
+        parts = [uploaded_file.getvalue().decode() for uploaded_file in uploaded_files]
+        fasta_content = "\n".join(parts) + "\n"
         validate_input(fasta_content)
     else:
-        st.session_state.clear()
-
-# Configure settings
-st.subheader("Settings")
-
-## Embedding model selection
-model_options = PRETRAINED_MODELS.keys()
-col1, col2 = st.columns([2, 1])
-with col1:
-    st.write("Select embedding model:")
-with col2:
-    st.session_state["selected_model"] = st.selectbox(
-        "Select embedding model", model_options, label_visibility="collapsed"
-    )
-
-## Number of top matched results to display
-col1, col2 = st.columns([2, 1])
-with col1:
-    st.write("Number of top matched results to display:")
-with col2:
-    st.session_state["top_n"] = st.number_input(
-        label="Number of top matched results to display",
-        min_value=1,
-        max_value=5,
-        value=2,
-        step=1,
-        format="%d",
-        label_visibility="collapsed",
-    )
+        _clear_inputs()
 
 
 # Function to process FASTA input and run TaxoTagger
-def process_fasta_and_run(fasta_content):
-    """Process the FASTA content and run TaxoTagger."""
+@st.cache_data(show_spinner="Running TaxoTagger…", max_entries=8)
+def _run_search(fasta_digest, _fasta_content, model_id, top_n):
+    """Process the FASTA content and run TaxoTagger.
+
+    Results are cached on the FASTA digest, model ID and top N; the content
+    itself and `tt` (a cached resource from the enclosing scope) are not hashed.
+    """
     with tempfile.NamedTemporaryFile(
-        mode="w+", delete=False, suffix=".fasta"
+        mode="w+", delete=False, suffix=".fasta", dir=TEMP_DIR
     ) as temp_fasta:
-        temp_fasta.write(fasta_content)
+        temp_fasta.write(_fasta_content)
         temp_fasta.flush()
 
         try:
             results = tt.search(
                 temp_fasta.name,
-                model_id=st.session_state["selected_model"],
-                limit=st.session_state["top_n"],
+                model_id=model_id,
+                limit=top_n,
             )
             return results
         finally:
             os.unlink(temp_fasta.name)
 
 
-# Run button
-if st.button("Run TaxoTagger", type="primary", use_container_width=True):
+def _result_row(results, seq_id, i, j):
+    """Flatten the j-th match of the i-th input sequence into one result row."""
+    row = {"Sequence_ID": seq_id, "Rank": j + 1}
+    for level, level_cap in TAX_PAIRS:
+        level_results = results[level]
+        hits = level_results[i] if i < len(level_results) else []
+        if j >= len(hits):
+            # Handle the case where there are fewer results than expected
+            row[level_cap] = "No match found"
+            continue
+
+        match = hits[j]
+        value = match["entity"].get(level, "")
+        if value:
+            row[level_cap] = value
+            row[level_cap + "_Hit"] = match["id"]
+            row[level_cap + "_Similarity"] = match["distance"]
+        else:
+            row[level_cap] = ""
+            row[level_cap + "_Hit"] = ""
+            row[level_cap + "_Similarity"] = ""
+    return row
+
+
+def _build_display_frames(combined_df):
+    """Format the results for display, returning one DataFrame per input sequence."""
+    df = combined_df.set_index("Rank")  # Set the rank as the index
+    drop_cols = []
+    # combine taxonomy label with the hit and similarity
+    for level, level_cap in TAX_PAIRS:
+        labels = df[level_cap].fillna("").to_numpy(dtype=object)
+        hits = df[level_cap + "_Hit"].fillna("").to_numpy(dtype=object)
+        sims = pd.to_numeric(df[level_cap + "_Similarity"], errors="coerce")
+        sim_str = np.char.mod("%.3f", sims.to_numpy(dtype=float)).astype(object)
+        # cells without a hit (empty label or no match) keep the label only
+        df[level_cap] = np.where(
+            hits != "", labels + " (" + hits + ";" + sim_str + ")", labels
+        )
+        drop_cols += [level_cap + "_Hit", level_cap + "_Similarity"]
+    df.drop(columns=drop_cols, inplace=True)
+    return {
+        seq_id: group.drop(columns=["Sequence_ID"])  # Drop the sequence ID column
+        for seq_id, group in df.groupby("Sequence_ID", sort=False)
+    }
+
+
+# Configure settings and run, in a form so changing a setting does not rerun the app
+with st.form("run_form"):
+    st.subheader("Settings")
+
+    ## Embedding model selection
+    model_options = PRETRAINED_MODELS.keys()
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.write("Select embedding model:")
+    with col2:
+        st.session_state["selected_model"] = st.selectbox(
+            "Select embedding model", model_options, label_visibility="collapsed"
+        )
+
+    ## Number of top matched results to display
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.write("Number of top matched results to display:")
+    with col2:
+        st.session_state["top_n"] = st.number_input(
+            label="Number of top matched results to display",
+            min_value=1,
+            max_value=5,
+            value=2,
+            step=1,
+            format="%d",
+            label_visibility="collapsed",
+        )
+
+    submitted = st.form_submit_button(
+        "Run TaxoTagger", type="primary", use_container_width=True
+    )
+
+if submitted:
     if "fasta_content" not in st.session_state:
         st.error("Please provide FASTA input before running the analysis.", icon="💡")
         st.stop()
 
-    results = process_fasta_and_run(st.session_state["fasta_content"])
+    results = _run_search(
+        st.session_state["fasta_digest"],
+        st.session_state["fasta_content"],
+        st.session_state["selected_model"],
+        st.session_state["top_n"],
+    )
     seq_ids = st.session_state["seq_ids"]
 
     # Check if the number of results matches the number of input sequences
-    if len(results[TAXONOMY_LEVELS[0]]) != len(seq_ids):
+    # Results keep the input order, so any missing ones are at the end
+    n_returned = len(results[TAXONOMY_LEVELS[0]])
+    if n_returned != len(seq_ids):
+        unprocessed_ids = seq_ids[n_returned:]
         st.error(
-            f"Mismatch between number of input sequences ({len(seq_ids)}) and results ({len(results[TAXONOMY_LEVELS[0]])}).",
+            f"Mismatch between number of input sequences ({len(seq_ids)}) and results ({n_returned})."
+            + (
+                f"\n\nNo results for: `{'`, `'.join(unprocessed_ids)}`"
+                if unprocessed_ids
+                else ""
+            ),
             icon="⚠️",
         )
 
     # Process results
-    results_by_seq = {}
-    for i, seq_id in enumerate(seq_ids):
-        results_by_seq[seq_id] = []
-        for j in range(st.session_state["top_n"]):
-            result = {}
-            result["Sequence_ID"] = seq_id
-            result["Rank"] = j + 1
-            for level in TAXONOMY_LEVELS:
-                level_cap = level.capitalize()
-                try:
-                    match = results[level][i][j]
-                    value = match["entity"].get(level, "")
-                    if value:
-                        result[level_cap] = value
-                        result[level_cap + "_Hit"] = match["id"]
-                        result[level_cap + "_Similarity"] = match["distance"]
-                    else:
-                        result[level_cap] = ""
-                        result[level_cap + "_Hit"] = ""
-                        result[level_cap + "_Similarity"] = ""
-                except IndexError:
-                    # Handle the case where there are fewer results than expected
-                    result[level_cap] = "No match found"
-            results_by_seq[seq_id].append(result)
-    st.session_state["results_by_seq"] = results_by_seq
-
-if "results_by_seq" in st.session_state:
-    results_by_seq = st.session_state["results_by_seq"]
-
-    # Display results for the selected sequence
-    st.subheader(
-        "Results",
-        help="""The predicted taxonomy labels for each input DNA sequence are displayed below
-            with a format of 'TaxonomyLabel (ID;COS)' in each cell. Where, 'ID' is the ID of the
-            matched DNA sequence, and 'COS' is the cosine similarity between the input DNA sequence
-            and the matched DNA sequence, ranging from 0 (no match) to 1 (perfect match).""",
-    )
-    selected_seq_id = st.selectbox(
-        "For input sequence:",
-        results_by_seq.keys(),
-    )
-
-    df = pd.DataFrame(results_by_seq[selected_seq_id])
-    df = df.drop(columns=["Sequence_ID"])  # Drop the sequence ID column
-    df.set_index("Rank", inplace=True)  # Set the rank as the index
-    for level in TAXONOMY_LEVELS:  # combine taxonomy label with the hit and similarity
-        level_cap = level.capitalize()
-        df[level_cap] = (
-            df[level_cap]
-            + " ("
-            + df[level_cap + "_Hit"]
-            + ";"
-            + df[level_cap + "_Similarity"].round(3).astype(str)
-            + ")"
+    rows = [
+        _result_row(results, seq_id, i, j)
+        for i, seq_id in enumerate(seq_ids)
+        for j in range(st.session_state["top_n"])
+    ]
+    columns = ["Sequence_ID", "Rank"]
+    for level, level_cap in TAX_PAIRS:
+        columns += [level_cap, level_cap + "_Hit", level_cap + "_Similarity"]
+    combined_df = pd.DataFrame.from_records(rows, columns=columns)
+    # Format once per run so switching sequences is a plain dict lookup
+    st.session_state["display_frames"] = _build_display_frames(combined_df)
+    st.session_state["csv_bytes"] = combined_df.to_csv(index=False).encode()
+    # Record the input and settings the results were computed for
+    st.session_state["results_input"] = {
+        "fasta_digest": st.session_state["fasta_digest"],
+        "model": st.session_state["selected_model"],
+        "top_n": st.session_state["top_n"],
+    }
+
+if "display_frames" in st.session_state:
+    results_input = st.session_state["results_input"]
+    if results_input["fasta_digest"] != st.session_state.get("fasta_digest"):
+        st.info(
+            "The input has changed since the last run. Click **Run TaxoTagger** to get results for the current input.",
+            icon="💡",
+        )
+    else:
+        # Display results for the selected sequence
+        st.subheader(
+            "Results",
+            help="""The predicted taxonomy labels for each input DNA sequence are displayed below
+                with a format of 'TaxonomyLabel (ID;COS)' in each cell. Where, 'ID' is the ID of the
+                matched DNA sequence, and 'COS' is the cosine similarity between the input DNA sequence
+                and the matched DNA sequence, ranging from 0 (no match) to 1 (perfect match).""",
+        )
+        st.caption(
+            f"Model: {results_input['model']}, top {results_input['top_n']} matches"
+        )
+        display_frames = st.session_state["display_frames"]
+        selected_seq_id = st.selectbox(
+            "For input sequence:",
+            display_frames.keys(),
+        )
+        st.dataframe(display_frames[selected_seq_id])
+
+        # Download results of all sequences
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+        file_name = f"taxotagger_results_{timestamp}.csv"
+        st.download_button(
+            label="Download all results",
+            data=st.session_state["csv_bytes"],
+            file_name=file_name,
+            mime="text/csv",
         )
-        df = df.drop(columns=[level_cap + "_Hit", level_cap + "_Similarity"])
-    st.dataframe(df)
-
-    # Combine results of all sequences for download
-    combined_results = []
-    for seq_id in results_by_seq:
-        combined_results.extend(results_by_seq[seq_id])
-    combined_df = pd.DataFrame(combined_results)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
-    file_name = f"taxotagger_results_{timestamp}.csv"
-    st.download_button(
-        label="Download all results",
-        data=combined_df.to_csv(index=False),
-        file_name=file_name,
-        mime="text/csv",
-    )
 
 
 # Footer